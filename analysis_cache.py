@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Caches for conversation analysis results, so repeated conversations don't need another LLM call.
+"""
+
+import hashlib
+import os
+import shelve
+from typing import List, Dict, Any, Optional
+
+import orjson
+
+try:
+    import faiss
+    import numpy as np
+except ImportError:  # Semantic cache is optional
+    faiss = None
+    np = None
+
+
+class ExactCache:
+    """
+    Persistent cache of analysis results keyed by a hash of (model, prompt, transcript).
+    Only byte-identical inputs hit, so it never returns a result for a different conversation.
+    """
+
+    def __init__(self, cache_dir: str = ".analysis_cache"):
+        self.cache_file = os.path.join(cache_dir, "exact")
+
+    @staticmethod
+    def make_key(model: str, prompt: str, transcript: str) -> str:
+        """Hash the inputs that fully determine an analysis result."""
+        return hashlib.sha256((prompt + "\x00" + transcript + "\x00" + model).encode('utf-8')).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Return the cached classifications for the given keys (missing keys are left out)."""
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with shelve.open(self.cache_file) as cache:
+                return {key: cache[key] for key in keys if key in cache}
+        except Exception as e:
+            print(f"Error reading exact cache: {e}")
+            return {}
+
+    def set_many(self, items: Dict[str, Dict[str, Any]]):
+        """Store classifications under their keys."""
+        if not items:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with shelve.open(self.cache_file) as cache:
+                cache.update(items)
+        except Exception as e:
+            print(f"Error saving exact cache: {e}")
+
+
+class SemanticCache:
+    """
+    Nearest-neighbour cache of analysis results keyed by transcript embedding.
+    A lookup hits when the cosine similarity to a stored transcript is at least the threshold.
+    Each (model, prompt) pair gets its own index files, so results never leak across models or prompts.
+    Requires faiss and numpy; the cache is disabled when they are not installed.
+    """
+
+    def __init__(self, model: str, prompt: str, cache_dir: str = ".analysis_cache", dimension: int = 1536, threshold: float = 0.95):
+        self.dimension = dimension
+        self.threshold = threshold
+        namespace = hashlib.sha256((prompt + "\x00" + model).encode('utf-8')).hexdigest()[:16]
+        self.index_file = os.path.join(cache_dir, f"semantic-{namespace}.index")
+        self.entries_file = os.path.join(cache_dir, f"semantic-{namespace}.json")
+        self.index = None
+        self.entries: List[Dict[str, Any]] = []
+
+        if faiss is None:
+            print("faiss not installed, semantic cache disabled")
+            return
+
+        # Inner product on normalized vectors is cosine similarity
+        self.index = faiss.IndexFlatIP(dimension)
+
+        # Load persisted cache if present
+        if os.path.exists(self.index_file) and os.path.exists(self.entries_file):
+            try:
+                index = faiss.read_index(self.index_file)
+                with open(self.entries_file, 'rb') as f:
+                    entries = orjson.loads(f.read())
+                if index.ntotal == len(entries) and index.d == dimension:
+                    self.index = index
+                    self.entries = entries
+                else:
+                    print("Semantic cache files out of sync, starting fresh")
+            except Exception as e:
+                print(f"Error loading semantic cache, starting fresh: {e}")
+
+    @property
+    def enabled(self) -> bool:
+        return self.index is not None
+
+    def _normalize(self, embedding: List[float]):
+        vector = np.asarray([embedding], dtype='float32')
+        faiss.normalize_L2(vector)
+        return vector
+
+    def lookup(self, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """Return the cached classification of the nearest stored transcript, or None on a miss."""
+        if not self.enabled or self.index.ntotal == 0:
+            return None
+
+        scores, ids = self.index.search(self._normalize(embedding), 1)
+        if ids[0, 0] >= 0 and scores[0, 0] >= self.threshold:
+            return self.entries[ids[0, 0]]
+        return None
+
+    def add(self, embedding: List[float], classification: Dict[str, Any]):
+        """Store a classification under its transcript embedding."""
+        if not self.enabled:
+            return
+
+        self.index.add(self._normalize(embedding))
+        self.entries.append(classification)
+
+    def save(self):
+        """Persist the index and its classifications to disk."""
+        if not self.enabled:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+            faiss.write_index(self.index, self.index_file)
+            with open(self.entries_file, 'wb') as f:
+                f.write(orjson.dumps(self.entries))
+        except Exception as e:
+            print(f"Error saving semantic cache: {e}")
@@ -4,29 +4,98 @@ Conversation Analysis Script for Marriage/Organizations Firm
 Important: Once you fine tune your model, replace the model id in the conversation_analyzer.py file with your finetuned model id. Those models have a "ft:" prefix.
 """
 
-import json
+import asyncio
+import contextlib
+import io
 import os
 import sys
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 import time
+from collections import Counter
+from itertools import islice
 from pathlib import Path
 
+import fastjsonschema
+import ijson
 import openai
-from openai import OpenAI
+import orjson
+from openai import AsyncOpenAI, OpenAI
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 from tqdm import tqdm
 from dotenv import load_dotenv
 
+from analysis_cache import ExactCache, SemanticCache
+
 # Load environment variables
 load_dotenv('secrets.env')
 
+# Embedding settings for the semantic cache
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_BATCH_SIZE = 32
+EMBEDDING_MAX_CHARS = 16000  # Longer transcripts would exceed the embedding model's token limit and skip the semantic cache
+
+# Analysis results, one JSON object per line
+OUTPUT_FILE = "classification_results.jsonl"
+
+# Batch API input limits per job, with headroom below the 200 MB file size limit
+BATCH_MAX_REQUESTS = 50000
+BATCH_MAX_BYTES = 190 * 1024 * 1024
+# Batch jobs submitted but not collected yet, so an interrupted run can pick them up again
+BATCH_JOBS_FILE = os.path.join(".analysis_cache", "batch_jobs.json")
+
+_backoff = wait_exponential_jitter(initial=1, max=30)
+
+def _wait_for_retry(retry_state) -> float:
+    """Back off exponentially with jitter, but never for less than the server's retry-after-ms / Retry-After."""
+    wait = _backoff(retry_state)
+    response = getattr(retry_state.outcome.exception(), 'response', None)
+    if response is not None:
+        headers = response.headers
+        try:
+            if 'retry-after-ms' in headers:
+                wait = max(wait, float(headers['retry-after-ms']) / 1000)
+            else:
+                wait = max(wait, float(headers.get('retry-after', 0)))
+        except ValueError:  # HTTP-date form, fall back to the backoff
+            pass
+    return wait
+
+def _is_transient_error(error: BaseException) -> bool:
+    """Errors the OpenAI SDK itself retries: connection errors and timeouts, 408, 409, 429 and 5xx."""
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    return isinstance(error, openai.APIStatusError) and (error.status_code in (408, 409, 429) or error.status_code >= 500)
+
+# Retry only transient errors; successful calls never sleep. The clients are built with
+# max_retries=0 so this is the only retry policy and attempts stay bounded.
+retry_transient_errors = retry(
+    retry=retry_if_exception(_is_transient_error),
+    wait=_wait_for_retry,
+    stop=stop_after_attempt(6),
+    reraise=True
+)
+
 class ConversationAnalyzer:
-    def __init__(self):
-        """Initialize the conversation analyzer with OpenAI client."""
+    def __init__(self, max_concurrency: int = 64, pack_size: int = 1, use_cache: bool = True, use_semantic_cache: bool = True):
+        """
+        Initialize the conversation analyzer with OpenAI clients.
+        max_concurrency caps the number of in-flight requests; size it to your account's rate limits.
+        pack_size is the number of conversations analyzed per request. The default of 1 sends the single-transcript
+        prompt and schema the fine-tuned model is trained on; larger packs save requests at the cost of that match.
+        use_cache reuses results of identical earlier transcripts (same model and prompt) instead of re-analyzing them.
+        use_semantic_cache also reuses results of near-identical transcripts.
+        """
         self.api_key = os.getenv('OPENAI_API_KEY')
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY not found in secrets.env file")
         
-        self.client = OpenAI(api_key=self.api_key)
+        self.client = OpenAI(api_key=self.api_key, max_retries=0)
+        self.aclient = AsyncOpenAI(api_key=self.api_key, max_retries=0)
+        self.max_concurrency = max_concurrency
+        self.pack_size = max(1, pack_size)
+        self.exact_cache = ExactCache() if use_cache else None
+        
+        self.model = "gpt-4.1"  #IMPORTANT: After you fine tune your model, replace this with your finetuned model id. Those models have a "ft:" prefix
         
         # Define the JSON schema for structured outputs
         self.response_schema = {
@@ -127,189 +196,847 @@ Note: You may observe that the AI asks a few questions in the beginning without
 
 **Conversation Transcript:**
 """
+        
+        # Constant openings of the user turn. Together with the static system prompt they form a
+        # byte-identical request prefix, so OpenAI's automatic prompt caching can reuse it across calls.
+        # Only the transcripts vary, and they always come last.
+        self.user_preamble = "Analyze the following conversation transcript:\n\n"
+        self.packed_user_preamble = (
+            "Analyze each conversation transcript below; return a JSON object {\"results\": [...]} "
+            "with one analysis per transcript, in the same order.\n\n"
+        )
+        
+        # Request parts that are identical for every call, built once instead of per request
+        self._system_message = {"role": "system", "content": self.analysis_prompt}
+        self._response_format = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "conversation_analysis",
+                "schema": self.response_schema,
+                "strict": True
+            }
+        }
+        self._packed_response_formats: Dict[int, Dict[str, Any]] = {}
+        
+        # Client-side check of model output, compiled once into a dedicated validator function
+        self._validate = fastjsonschema.compile(self.response_schema)
+        self._packed_validators: Dict[int, Any] = {}
+        
+        # Semantic cache entries are kept per model and prompt, so changing either never reuses stale analyses
+        self.semantic_cache = SemanticCache(self.model, self.analysis_prompt) if use_semantic_cache else None
+        
+        # Prompt token usage, to verify prompt cache hits
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.streamed_chars = 0
 
-    def load_conversations(self, file_path: str) -> List[Dict[str, Any]]:
-        """Load conversations from JSON file."""
+    def load_conversations(self, file_path: str) -> Iterator[Dict[str, Any]]:
+        """
+        Stream conversations from a JSON array file, one conversation at a time.
+        The file is only opened here; it is parsed lazily as the returned iterator is consumed.
+        """
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                conversations = json.load(f)
-            
-            print(f"Loaded {len(conversations)} conversations from {file_path}")
-            return conversations
-        
+            f = open(file_path, 'rb')
         except FileNotFoundError:
             print(f"Error: File '{file_path}' not found.")
             sys.exit(1)
-        except json.JSONDecodeError as e:
-            print(f"Error: Invalid JSON in '{file_path}': {e}")
-            sys.exit(1)
         except Exception as e:
             print(f"Error loading conversations: {e}")
             sys.exit(1)
+        
+        print(f"Streaming conversations from {file_path}")
+        return self._iter_conversations(f, file_path)
+
+    def _iter_conversations(self, f, file_path: str) -> Iterator[Dict[str, Any]]:
+        """Yield the items of the JSON array in an open file."""
+        with f:
+            try:
+                yield from ijson.items(f, 'item', use_float=True)
+            except ijson.JSONError as e:
+                print(f"Error: Invalid JSON in '{file_path}': {e}")
+                sys.exit(1)
+
+    def _format_transcript(self, conversation: Dict[str, Any]) -> str:
+        """Create properly formatted transcript from message list."""
+        messages = conversation['transcript_list_of_messages']
+        return '\n\n'.join(f"{msg['sender']}: {msg['text']}" for msg in messages)
+
+    def _build_request_body(self, conversation: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the chat completions request payload for a single conversation."""
+        cleaned_transcript = self._format_transcript(conversation)
+        
+        # Only the user turn varies between requests
+        user_message = self.user_preamble + cleaned_transcript
+        
+        return {
+            "model": self.model,
+            "messages": [
+                self._system_message,
+                {"role": "user", "content": user_message}
+            ],
+            "response_format": self._response_format,
+        }
+
+    def _record_usage(self, response):
+        """Accumulate prompt token usage, including tokens served from OpenAI's prompt cache."""
+        usage = getattr(response, 'usage', None)
+        if not usage:
+            return
+        
+        self.prompt_tokens += usage.prompt_tokens or 0
+        details = getattr(usage, 'prompt_tokens_details', None)
+        if details and details.cached_tokens:
+            self.cached_prompt_tokens += details.cached_tokens
+
+    def _read_stream(self, stream) -> str:
+        """Collect a streamed completion into its full content, recording usage from the final chunk."""
+        parts = []
+        for chunk in stream:
+            if chunk.choices:
+                parts.append(chunk.choices[0].delta.content or "")
+            if chunk.usage:
+                self._record_usage(chunk)
+        
+        return "".join(parts)
+
+    async def _aread_stream(self, stream, progress: tqdm) -> str:
+        """Collect a streamed completion on the async client, showing received output in the progress bar."""
+        parts = []
+        async for chunk in stream:
+            if chunk.choices:
+                content = chunk.choices[0].delta.content or ""
+                parts.append(content)
+                self.streamed_chars += len(content)
+                progress.set_postfix(received=f"{self.streamed_chars} chars", refresh=False)
+            if chunk.usage:
+                self._record_usage(chunk)
+        
+        return "".join(parts)
+
+    def _embed_transcripts(self, conversations: List[Dict[str, Any]]) -> List[Optional[List[float]]]:
+        """
+        Embed conversation transcripts for the semantic cache (None where embedding failed).
+        Transcripts over EMBEDDING_MAX_CHARS are not embedded: a truncated embedding would drop the end of
+        the conversation, which decides bot_answered and the final sentiment, and match unrelated conversations.
+        """
+        transcripts = [self._format_transcript(conversation) for conversation in conversations]
+        embeddings: List[Optional[List[float]]] = [None] * len(transcripts)
+        
+        indices = [i for i, transcript in enumerate(transcripts) if len(transcript) <= EMBEDDING_MAX_CHARS]
+        for start in range(0, len(indices), EMBEDDING_BATCH_SIZE):
+            chunk = indices[start:start + EMBEDDING_BATCH_SIZE]
+            try:
+                response = retry_transient_errors(self.client.embeddings.create)(
+                    model=EMBEDDING_MODEL,
+                    input=[transcripts[i] for i in chunk]
+                )
+                for i, item in zip(chunk, response.data):
+                    embeddings[i] = item.embedding
+            except openai.APIError as e:
+                print(f"OpenAI API error embedding transcripts, skipping semantic cache for them: {e}")
+        
+        return embeddings
+
+    def _check_caches(self, conversations: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Split conversations into cached results and conversations that still need analysis.
+        The exact cache is checked first, then the semantic cache for the remaining conversations.
+        Also returns the cache keys of the pending conversations, by position (conversation ids need not be unique).
+        """
+        cached_results = []
+        pending = []
+        pending_keys = []
+        
+        exact_keys = []
+        hits = {}
+        if self.exact_cache:
+            exact_keys = [
+                ExactCache.make_key(self.model, self.analysis_prompt, self._format_transcript(conversation))
+                for conversation in conversations
+            ]
+            hits = self.exact_cache.get_many(exact_keys)
+        
+        for i, conversation in enumerate(conversations):
+            if not exact_keys:
+                pending.append(conversation)
+                pending_keys.append({})
+                continue
+            
+            classification = hits.get(exact_keys[i])
+            if classification is not None:
+                cached_results.append({
+                    "conversation_id": conversation['metadata']['conversation_id'],
+                    "llm_classification": classification
+                })
+            else:
+                pending.append(conversation)
+                pending_keys.append({'exact': exact_keys[i]})
+        
+        if cached_results:
+            print(f"Exact cache hits: {len(cached_results)} conversations")
+        
+        if pending and self.semantic_cache and self.semantic_cache.enabled:
+            semantic_hits = 0
+            still_pending = []
+            still_pending_keys = []
+            for conversation, keys, embedding in zip(pending, pending_keys, self._embed_transcripts(pending)):
+                classification = self.semantic_cache.lookup(embedding) if embedding is not None else None
+                
+                if classification is not None:
+                    cached_results.append({
+                        "conversation_id": conversation['metadata']['conversation_id'],
+                        "llm_classification": classification
+                    })
+                    semantic_hits += 1
+                else:
+                    if embedding is not None:
+                        keys['embedding'] = embedding
+                    still_pending.append(conversation)
+                    still_pending_keys.append(keys)
+            pending = still_pending
+            pending_keys = still_pending_keys
+            
+            if semantic_hits:
+                print(f"Semantic cache hits: {semantic_hits} conversations")
+        
+        return cached_results, pending, pending_keys
+
+    def _update_caches(self, results: List[Optional[Dict[str, Any]]], pending_keys: List[Dict[str, Any]]):
+        """
+        Add freshly analyzed conversations to the caches and persist them.
+        results is aligned with pending_keys, with None for conversations that were not analyzed.
+        """
+        exact_items = {}
+        semantic_added = False
+        
+        for result, keys in zip(results, pending_keys):
+            if result is None:
+                continue
+            if 'exact' in keys:
+                exact_items[keys['exact']] = result['llm_classification']
+            if 'embedding' in keys:
+                self.semantic_cache.add(keys['embedding'], result['llm_classification'])
+                semantic_added = True
+        
+        if self.exact_cache:
+            self.exact_cache.set_many(exact_items)
+        if semantic_added:
+            self.semantic_cache.save()
 
     def analyze_conversation(self, conversation: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Analyze a single conversation using OpenAI API with structured outputs."""
         try:
             conversation_id = conversation['metadata']['conversation_id']
             
-            # Create properly formatted transcript from message list
-            messages = conversation['transcript_list_of_messages']
-            formatted_transcript = []
-            
-            for msg in messages:
-                sender = msg['sender']
-                text = msg['text']
-                formatted_line = f"{sender}: {text}"
-                formatted_transcript.append(formatted_line)
+            # Reuse the analysis of an identical or near-identical transcript if we have one
+            cached_results, _, cache_keys = self._check_caches([conversation])
+            if cached_results:
+                return cached_results[0]
             
-            cleaned_transcript = '\n\n'.join(formatted_transcript)
+            # Make API call with structured outputs and parse the validated response
+            analysis_result = self._complete_with_repair(self._build_request_body(conversation), self._parse_analysis)
             
-            # Prepare messages
-            system_message = self.analysis_prompt
-            user_message = f"Analyze the following conversation transcript:\n\n{cleaned_transcript}"
+            result = {
+                "conversation_id": conversation_id,
+                "llm_classification": analysis_result
+            }
+            self._update_caches([result], cache_keys)
             
+            return result
             
-            # Make API call with structured outputs
-            response = self.client.chat.completions.create(
-                model="gpt-4.1",  #IMPORTANT: After you fine tune your model, replace this with your finetuned model id. Those models have a "ft:" prefix
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": user_message}
-                ],
-                response_format={
-                    "type": "json_schema",
-                    "json_schema": {
-                        "name": "conversation_analysis",
-                        "schema": self.response_schema,
-                        "strict": True
+        except Exception as e:
+            self._report_analysis_error(e, f"conversation {conversation_id}")
+            return None
+
+    def _report_analysis_error(self, error: Exception, target: str):
+        """Print why analyzing target (e.g. "conversation <id>") failed; shared by the sync/async and single/packed paths."""
+        if isinstance(error, openai.APIError):
+            print(f"OpenAI API error for {target}: {error}")
+        elif isinstance(error, orjson.JSONDecodeError):
+            print(f"JSON parsing error for {target}: {error}")
+        elif isinstance(error, fastjsonschema.JsonSchemaException):
+            print(f"Schema validation error for {target}: {error.message}")
+        else:
+            print(f"Unexpected error analyzing {target}: {error}")
+
+    def _build_packed_request_body(self, conversations: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Build a single chat completions request payload that analyzes several conversations at once."""
+        # Transcripts are identified by position only, so no ids leak into the prompt
+        sections = []
+        for i, conversation in enumerate(conversations, 1):
+            sections.append(f"### Transcript {i}:\n{self._format_transcript(conversation)}")
+        
+        # Only the user turn varies between requests
+        user_message = self.packed_user_preamble + '\n\n'.join(sections)
+        
+        return {
+            "model": self.model,
+            "messages": [
+                self._system_message,
+                {"role": "user", "content": user_message}
+            ],
+            "response_format": self._packed_response_format(len(conversations)),
+        }
+
+    def _packed_response_format(self, pack_size: int) -> Dict[str, Any]:
+        """Return the response format for a pack of the given size, building it once per size."""
+        if pack_size not in self._packed_response_formats:
+            # Wrap the single conversation schema in an array with exactly one entry per transcript
+            packed_schema = {
+                "type": "object",
+                "properties": {
+                    "results": {
+                        "type": "array",
+                        "items": self.response_schema,
+                        "minItems": pack_size,
+                        "maxItems": pack_size
                     }
                 },
+                "required": ["results"],
+                "additionalProperties": False
+            }
+            self._packed_response_formats[pack_size] = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "conversation_analysis_pack",
+                    "schema": packed_schema,
+                    "strict": True
+                }
+            }
+            self._packed_validators[pack_size] = fastjsonschema.compile(packed_schema)
+        
+        return self._packed_response_formats[pack_size]
+
+    def _parse_analysis(self, content: str) -> Dict[str, Any]:
+        """Parse a model response and validate it against the response schema."""
+        return self._validate(orjson.loads(content))
+
+    def _parse_packed_response(self, conversations: List[Dict[str, Any]], content: str) -> List[Dict[str, Any]]:
+        """Validate a packed response (one analysis per conversation) and map the analyses back to their conversation ids."""
+        self._packed_response_format(len(conversations))  # Compiles the validator for this pack size if needed
+        analysis_results = self._packed_validators[len(conversations)](orjson.loads(content))['results']
+        
+        return [
+            {
+                "conversation_id": conversation['metadata']['conversation_id'],
+                "llm_classification": analysis_result
+            }
+            for conversation, analysis_result in zip(conversations, analysis_results)
+        ]
 
+    def analyze_conversation_pack(self, conversations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Analyze several conversations in a single OpenAI API request with structured outputs."""
+        conversation_ids = [conversation['metadata']['conversation_id'] for conversation in conversations]
+        try:
+            return self._complete_with_repair(
+                self._build_packed_request_body(conversations),
+                lambda content: self._parse_packed_response(conversations, content)
             )
             
-            # Parse the response
-            analysis_result = json.loads(response.choices[0].message.content)
+        except Exception as e:
+            self._report_analysis_error(e, f"conversations {conversation_ids}")
+            return []
+
+    def _repair_request_body(self, request_body: Dict[str, Any], content: str, error: Exception) -> Dict[str, Any]:
+        """Build a follow-up request that shows the model its invalid output and asks for a corrected one."""
+        reason = error.message if isinstance(error, fastjsonschema.JsonSchemaException) else str(error)
+        return {
+            **request_body,
+            "messages": request_body["messages"] + [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": f"Your previous response was invalid: {reason}. Return the complete corrected JSON that matches the schema."}
+            ]
+        }
+
+    def _complete_with_repair(self, request_body: Dict[str, Any], parse):
+        """Run a streamed request and parse its output; if the output is invalid, retry once with a repair prompt."""
+        content = self._read_stream(self._create_completion(request_body))
+        try:
+            return parse(content)
+        except (orjson.JSONDecodeError, fastjsonschema.JsonSchemaException) as e:
+            print(f"Invalid model output, retrying once with a repair prompt: {e}")
+            repair_body = self._repair_request_body(request_body, content, e)
+            return parse(self._read_stream(self._create_completion(repair_body)))
+
+    async def _acomplete_with_repair(self, request_body: Dict[str, Any], parse, sem: asyncio.Semaphore, progress: tqdm):
+        """Async counterpart of _complete_with_repair; each attempt holds a semaphore slot until its stream is read."""
+        async with sem:
+            stream = await self._create_completion_async(request_body)
+            content = await self._aread_stream(stream, progress)
+        try:
+            return parse(content)
+        except (orjson.JSONDecodeError, fastjsonschema.JsonSchemaException) as e:
+            print(f"Invalid model output, retrying once with a repair prompt: {e}")
+            async with sem:
+                stream = await self._create_completion_async(self._repair_request_body(request_body, content, e))
+                content = await self._aread_stream(stream, progress)
+            return parse(content)
+
+    @retry_transient_errors
+    def _create_completion(self, request_body: Dict[str, Any]):
+        """Open a streamed chat completions request, backing off exponentially on rate limits and timeouts."""
+        return self.client.chat.completions.create(
+            **request_body,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+
+    @retry_transient_errors
+    async def _create_completion_async(self, request_body: Dict[str, Any]):
+        """Async counterpart of _create_completion."""
+        return await self.aclient.chat.completions.create(
+            **request_body,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+
+    async def _analyze_one(self, conversation: Dict[str, Any], sem: asyncio.Semaphore, progress: tqdm) -> Optional[Dict[str, Any]]:
+        """Analyze a single conversation on the async client, bounded by the shared semaphore."""
+        conversation_id = None
+        try:
+            conversation_id = conversation['metadata']['conversation_id']
+            
+            analysis_result = await self._acomplete_with_repair(
+                self._build_request_body(conversation), self._parse_analysis, sem, progress
+            )
             
             return {
                 "conversation_id": conversation_id,
                 "llm_classification": analysis_result
             }
             
-        except openai.APIError as e:
-            print(f"OpenAI API error for conversation {conversation_id}: {e}")
-            return None
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error for conversation {conversation_id}: {e}")
-            return None
         except Exception as e:
-            print(f"Unexpected error analyzing conversation {conversation_id}: {e}")
+            self._report_analysis_error(e, f"conversation {conversation_id}")
             return None
+        finally:
+            progress.update(1)
+
+    async def _analyze_pack(self, conversations: List[Dict[str, Any]], sem: asyncio.Semaphore, progress: tqdm) -> List[Dict[str, Any]]:
+        """Analyze a pack of conversations in one request on the async client."""
+        if len(conversations) == 1:
+            result = await self._analyze_one(conversations[0], sem, progress)
+            return [result] if result else []
+        
+        conversation_ids = [conversation['metadata']['conversation_id'] for conversation in conversations]
+        try:
+            return await self._acomplete_with_repair(
+                self._build_packed_request_body(conversations),
+                lambda content: self._parse_packed_response(conversations, content),
+                sem,
+                progress
+            )
+            
+        except Exception as e:
+            self._report_analysis_error(e, f"conversations {conversation_ids}")
+            return []
+        finally:
+            progress.update(len(conversations))
 
-    def analyze_conversations(self, conversations: List[Dict[str, Any]], start: Optional[int] = None, end: Optional[int] = None) -> List[Dict[str, Any]]:
-        """Analyze multiple conversations with progress tracking."""
+    async def _analyze_all(self, conversations: List[Dict[str, Any]], sink=None) -> List[Optional[Dict[str, Any]]]:
+        """
+        Analyze all conversations concurrently in packs of pack_size, with at most max_concurrency requests in flight.
+        Results are written to sink (an open results file) as soon as each pack completes.
+        Returns one entry per conversation, in input order, with None where analysis failed.
+        """
+        sem = asyncio.Semaphore(self.max_concurrency)
+        packs = [conversations[i:i + self.pack_size] for i in range(0, len(conversations), self.pack_size)]
+        
+        async def analyze_and_checkpoint(pack):
+            results = await self._analyze_pack(pack, sem, progress)
+            # Writes are synchronous, so they cannot interleave on the event loop thread
+            if sink:
+                self._write_results(sink, results)
+            return results
+        
+        with tqdm(total=len(conversations), desc="Analyzing conversations", unit="conv") as progress:
+            outcomes = await asyncio.gather(
+                *[analyze_and_checkpoint(pack) for pack in packs],
+                return_exceptions=True
+            )
+        
+        # Flatten pack results back into a list aligned with the input, with None for failed conversations;
+        # a pack either returns a result for every conversation in it or none at all
+        results = []
+        for pack, outcome in zip(packs, outcomes):
+            if isinstance(outcome, list) and len(outcome) == len(pack):
+                results.extend(outcome)
+            else:
+                results.extend([None] * len(pack))
+        return results
+
+    def analyze_conversations(self, conversations: Iterable[Dict[str, Any]], start: Optional[int] = None, end: Optional[int] = None, output_file: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Analyze multiple conversations concurrently with progress tracking.
+        Accepts any iterable (e.g. the stream from load_conversations); only the selected range is held in memory.
+        If output_file is given, conversations already in it are skipped and each new result is appended as soon as it completes.
+        """
         if start is not None and end is not None:
-            conversations = conversations[start:end]
+            conversations = list(islice(conversations, start, end))
             print(f"Analyzing conversations {start+1}-{end} ({len(conversations)} total)...")
         else:
+            conversations = list(conversations)
             print(f"Analyzing all {len(conversations)} conversations...")
         
-        results = []
-        failed_count = 0
+        if output_file:
+            conversations = self._skip_analyzed(conversations, output_file)
         
-        # Process conversations with progress bar
-        for conversation in tqdm(conversations, desc="Analyzing conversations", unit="conv"):
-            result = self.analyze_conversation(conversation)
-            
-            if result:
-                results.append(result)
-            else:
-                failed_count += 1
+        cached_results, pending, cache_keys = self._check_caches(conversations)
+        
+        with self._open_results_file(output_file) as sink:
+            if sink:
+                self._write_results(sink, cached_results)
             
-            # Small delay to avoid rate limiting
-            time.sleep(0.1)
+            # Process conversations concurrently, results come back aligned with pending
+            analyzed = asyncio.run(self._analyze_all(pending, sink)) if pending else []
+        self._update_caches(analyzed, cache_keys)
+        results = [result for result in analyzed if result]
+        failed_count = len(pending) - len(results)
+        
+        results = cached_results + results
+        print(f"Successfully analyzed: {len(results)} conversations")
+        if failed_count > 0:
+            print(f"Failed to analyze: {failed_count} conversations")
+        if self.prompt_tokens:
+            percentage = (self.cached_prompt_tokens / self.prompt_tokens) * 100
+            print(f"Prompt cache: {self.cached_prompt_tokens}/{self.prompt_tokens} input tokens cached ({percentage:.1f}%)")
+        
+        return results
+
+    def analyze_conversations_batch(self, conversations: Iterable[Dict[str, Any]], poll_interval: int = 30, output_file: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Analyze conversations through the OpenAI Batch API.
+        Requests are submitted as JSONL jobs, split to stay under the Batch API's per-job limits,
+        and the results are collected once the jobs complete.
+        If output_file is given, conversations already in it are skipped and new results are appended as they are parsed.
+        """
+        conversations = list(conversations)
+        if output_file:
+            conversations = self._skip_analyzed(conversations, output_file)
+        
+        cached_results, pending, cache_keys = self._check_caches(conversations)
         
+        with self._open_results_file(output_file) as sink:
+            if sink:
+                self._write_results(sink, cached_results)
+            results = self._run_batch_job(pending, poll_interval, sink) if pending else []
+        # Requests that errored out entirely only appear in the batch error file
+        failed_count = len(pending) - len(results)
+        
+        # Batch results come back by conversation id, which only identifies a conversation if it is unique
+        conversation_ids = [conversation['metadata']['conversation_id'] for conversation in pending]
+        id_counts = Counter(conversation_ids)
+        results_by_id = {result['conversation_id']: result for result in results}
+        self._update_caches(
+            [results_by_id.get(conversation_id) if id_counts[conversation_id] == 1 else None for conversation_id in conversation_ids],
+            cache_keys
+        )
+        
+        results = cached_results + results
         print(f"Successfully analyzed: {len(results)} conversations")
         if failed_count > 0:
             print(f"Failed to analyze: {failed_count} conversations")
         
         return results
 
-    def save_results(self, results: List[Dict[str, Any]], output_file: str = "classification_results.json"):
-        """Save analysis results to JSON file (appending to existing results)."""
+    def _split_batch_requests(self, conversations: List[Dict[str, Any]]) -> List[bytes]:
+        """Build the JSONL input, one chat completions request per conversation, split into files within the Batch API limits."""
+        files = []
+        lines = []
+        size = 0
+        for conversation in conversations:
+            line = orjson.dumps({
+                "custom_id": conversation['metadata']['conversation_id'],
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self._build_request_body(conversation)
+            })
+            if lines and (len(lines) == BATCH_MAX_REQUESTS or size + len(line) + 1 > BATCH_MAX_BYTES):
+                files.append(b'\n'.join(lines))
+                lines = []
+                size = 0
+            lines.append(line)
+            size += len(line) + 1
+        
+        if lines:
+            files.append(b'\n'.join(lines))
+        return files
+
+    def _run_batch_job(self, conversations: List[Dict[str, Any]], poll_interval: int, sink=None) -> List[Dict[str, Any]]:
+        """
+        Submit Batch API jobs for the given conversations, wait for them and parse their output into sink.
+        Jobs left running by an interrupted earlier run are collected first instead of being submitted again.
+        """
+        pending_ids = {conversation['metadata']['conversation_id'] for conversation in conversations}
+        results = []
+        
+        for job in self._load_batch_jobs():
+            if job['model'] != self.model:
+                print(f"Dropping batch job {job['id']} from an earlier run with model {job['model']}")
+                self._forget_batch_job(job['id'])
+                continue
+            print(f"Resuming batch job {job['id']} from an earlier run...")
+            results.extend(self._collect_batch(job['id'], poll_interval, sink, pending_ids))
+        
+        # Their conversations are unknown until collected, so submitting now could pay for them twice
+        if self._load_batch_jobs():
+            print("Earlier batch jobs could not be collected; run again before submitting new ones")
+            return results
+        
+        conversations = [c for c in conversations if c['metadata']['conversation_id'] in pending_ids]
+        if not conversations:
+            return results
+        
+        batch_files = self._split_batch_requests(conversations)
+        print(f"Submitting {len(batch_files)} batch job(s) for {len(conversations)} conversations...")
+        
+        # Submit every job up front so they run side by side, then collect them in order
+        batch_ids = []
+        for jsonl_bytes in batch_files:
+            batch_id = self._submit_batch(jsonl_bytes)
+            if batch_id:
+                batch_ids.append(batch_id)
+        
+        for batch_id in batch_ids:
+            results.extend(self._collect_batch(batch_id, poll_interval, sink, pending_ids))
+        
+        return results
+
+    def _load_batch_jobs(self) -> List[Dict[str, str]]:
+        """Return the batch jobs that were submitted but not collected yet."""
+        if not os.path.exists(BATCH_JOBS_FILE):
+            return []
+        
+        try:
+            with open(BATCH_JOBS_FILE, 'rb') as f:
+                return orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError) as e:
+            print(f"Error reading batch jobs file: {e}")
+            return []
+
+    def _save_batch_jobs(self, jobs: List[Dict[str, str]]):
+        """Persist the batch jobs that still need collecting."""
         try:
-            existing_results = []
+            os.makedirs(os.path.dirname(BATCH_JOBS_FILE), exist_ok=True)
+            with open(BATCH_JOBS_FILE, 'wb') as f:
+                f.write(orjson.dumps(jobs))
+        except OSError as e:
+            print(f"Error saving batch jobs file: {e}")
+
+    def _forget_batch_job(self, batch_id: str):
+        """Remove a collected (or abandoned) batch job from the batch jobs file."""
+        self._save_batch_jobs([job for job in self._load_batch_jobs() if job['id'] != batch_id])
+
+    def _submit_batch(self, jsonl_bytes: bytes) -> Optional[str]:
+        """Upload a JSONL input file and create a batch job for it; returns the batch id, or None on failure."""
+        try:
+            batch_input = retry_transient_errors(self.client.files.create)(
+                file=("batch_input.jsonl", io.BytesIO(jsonl_bytes)),
+                purpose="batch"
+            )
+            batch = retry_transient_errors(self.client.batches.create)(
+                input_file_id=batch_input.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+        except openai.APIError as e:
+            print(f"OpenAI API error submitting batch job: {e}")
+            return None
+        
+        print(f"Batch job created: {batch.id}")
+        self._save_batch_jobs(self._load_batch_jobs() + [{"id": batch.id, "model": self.model}])
+        return batch.id
+
+    def _poll_batch(self, batch_id: str):
+        """Fetch a batch job; transient API errors return None so a long-running job keeps being polled."""
+        try:
+            return retry_transient_errors(self.client.batches.retrieve)(batch_id)
+        except openai.APIError as e:
+            if not _is_transient_error(e):
+                raise
+            print(f"Error polling batch job {batch_id}, will keep polling: {e}")
+            return None
+
+    def _collect_batch(self, batch_id: str, poll_interval: int, sink, pending_ids: set) -> List[Dict[str, Any]]:
+        """
+        Wait for a batch job to finish and parse its output into sink.
+        Only conversations in pending_ids are collected, and they are removed from it once analyzed.
+        The job stays in the batch jobs file until its output is collected, so an interrupted run can resume it.
+        """
+        try:
+            batch = self._poll_batch(batch_id)
             
-            # Load existing results if file exists
-            if os.path.exists(output_file):
-                try:
-                    with open(output_file, 'r', encoding='utf-8') as f:
-                        existing_results = json.load(f)
-                    print(f"Loaded {len(existing_results)} existing results")
-                except (json.JSONDecodeError, Exception):
-                    print("Existing file corrupted, starting fresh")
-                    existing_results = []
+            # Poll until the batch reaches a terminal state
+            while batch is None or batch.status not in ['completed', 'failed', 'expired', 'cancelled']:
+                time.sleep(poll_interval)
+                batch = self._poll_batch(batch_id)
+                if batch is None:
+                    continue
+                counts = batch.request_counts
+                if counts:
+                    print(f"Batch {batch_id} status: {batch.status} ({counts.completed}/{counts.total} done)")
+                else:
+                    print(f"Batch {batch_id} status: {batch.status}")
             
-            # Append new results
-            all_results = existing_results + results
+            if not batch.output_file_id:
+                print(f"Batch job {batch_id} ended with status '{batch.status}'")
+                self._forget_batch_job(batch_id)
+                return []
+            if batch.status != 'completed':
+                # Expired and cancelled jobs still return the requests that finished
+                print(f"Batch job {batch_id} ended with status '{batch.status}', collecting its finished requests")
             
-            # Save combined results
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(all_results, f, ensure_ascii=False, indent=2)
+            output = retry_transient_errors(self.client.files.content)(batch.output_file_id).text
             
-            print(f"Results appended to '{output_file}'")
-            print(f"New classifications: {len(results)}")
-            print(f"Total classifications: {len(all_results)}")
+        except openai.APIError as e:
+            print(f"OpenAI API error during batch job {batch_id}, run again to resume it: {e}")
+            return []
+        except KeyboardInterrupt:
+            print(f"\nInterrupted; batch job {batch_id} keeps running on OpenAI and is collected on the next run")
+            raise
+        
+        results = []
+        
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            conversation_id = None
+            try:
+                item = orjson.loads(line)
+                conversation_id = item['custom_id']
+                if conversation_id not in pending_ids:
+                    continue
+                if item.get('error') or item['response']['status_code'] != 200:
+                    print(f"Batch request failed for conversation {conversation_id}: {item.get('error') or item['response']['body']}")
+                    continue
+                
+                content = item['response']['body']['choices'][0]['message']['content']
+                result = {
+                    "conversation_id": conversation_id,
+                    "llm_classification": self._parse_analysis(content)
+                }
+                results.append(result)
+                pending_ids.discard(conversation_id)
+                if sink:
+                    self._write_results(sink, [result])
+            except (orjson.JSONDecodeError, fastjsonschema.JsonSchemaException, KeyError, IndexError, TypeError) as e:
+                print(f"Error parsing batch result for conversation {conversation_id}: {e}")
+        
+        self._forget_batch_job(batch_id)
+        return results
+
+    def _skip_analyzed(self, conversations: List[Dict[str, Any]], output_file: str) -> List[Dict[str, Any]]:
+        """Drop conversations whose results are already in the output file, so interrupted runs can resume."""
+        if not os.path.exists(output_file):
+            return conversations
+        
+        done = set()
+        with open(output_file, 'rb') as f:
+            for line in f:
+                try:
+                    done.add(orjson.loads(line)['conversation_id'])
+                except (orjson.JSONDecodeError, KeyError, TypeError):
+                    continue  # Blank line or a partial line from an interrupted run
+        
+        remaining = [c for c in conversations if c['metadata']['conversation_id'] not in done]
+        skipped = len(conversations) - len(remaining)
+        if skipped:
+            print(f"Skipping {skipped} conversations already in '{output_file}'")
+        
+        return remaining
+
+    def _open_results_file(self, output_file: Optional[str]):
+        """Open the results file for appending (a no-op context when output_file is None)."""
+        if not output_file:
+            return contextlib.nullcontext()
+        
+        # Terminate a partial last line left by an interrupted run, so new records start on their own line
+        needs_newline = False
+        if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
+            with open(output_file, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b'\n'
+        
+        sink = open(output_file, 'ab')
+        if needs_newline:
+            sink.write(b'\n')
+        return sink
+
+    def _write_results(self, sink, results: List[Dict[str, Any]]):
+        """Append results to an open results file, one JSON object per line, and flush them to disk."""
+        for result in results:
+            sink.write(orjson.dumps(result) + b'\n')
+        sink.flush()
+
+    def save_results(self, results: List[Dict[str, Any]], output_file: str = OUTPUT_FILE, show_total: bool = False):
+        """
+        Append analysis results to a JSONL file, one result per line.
+        Only the new results are written; show_total counts the records already in the file.
+        """
+        try:
+            with self._open_results_file(output_file) as f:
+                self._write_results(f, results)
             
-            # Print summary statistics for new results only
-            if results:
-                self.print_summary_stats(results)
+            self.report_results(results, output_file, show_total)
                 
         except Exception as e:
             print(f"Error saving results: {e}")
 
+    def report_results(self, results: List[Dict[str, Any]], output_file: str = OUTPUT_FILE, show_total: bool = False):
+        """Print where the results were saved, optionally the file's total, and summary statistics of the new results."""
+        print(f"Results appended to '{output_file}'")
+        print(f"New classifications: {len(results)}")
+        if show_total:
+            with open(output_file, 'rb') as f:
+                total = sum(1 for line in f if line.strip())
+            print(f"Total classifications: {total}")
+        
+        # Print summary statistics for new results only
+        if results:
+            self.print_summary_stats(results)
+
     def print_summary_stats(self, results: List[Dict[str, Any]]):
         """Print summary statistics of the analysis results."""
-        sentiments = [r['llm_classification']['overall_sentiment'] for r in results]
-        bot_understanding = [r['llm_classification']['bot_understanding'] for r in results]
-        bot_performance = [r['llm_classification']['bot_performance'] for r in results]
+        # Tally every field in a single pass over the results
+        sentiment_counts = Counter()
+        understanding_counts = Counter()
+        performance_counts = Counter()
+        category_counts = Counter()
+        for result in results:
+            classification = result['llm_classification']
+            sentiment_counts[classification['overall_sentiment']] += 1
+            understanding_counts[classification['bot_understanding']] += 1
+            performance_counts[classification['bot_performance']] += 1
+            category_counts.update(classification['categories'])
         
         print("\nAnalysis Summary:")
         print("─" * 50)
         
         # Sentiment distribution
-        sentiment_counts = {s: sentiments.count(s) for s in ['positive', 'neutral', 'negative']}
         print("Sentiment Distribution:")
-        for sentiment, count in sentiment_counts.items():
+        for sentiment in ['positive', 'neutral', 'negative']:
+            count = sentiment_counts[sentiment]
             percentage = (count / len(results)) * 100
             print(f"  • {sentiment.capitalize()}: {count} ({percentage:.1f}%)")
         
         # Bot understanding distribution
-        understanding_counts = {p: bot_understanding.count(p) for p in ['good', 'acceptable', 'poor']}
         print("\nBot Understanding Distribution:")
-        for understanding, count in understanding_counts.items():
+        for understanding in ['good', 'acceptable', 'poor']:
+            count = understanding_counts[understanding]
             percentage = (count / len(results)) * 100
             print(f"  • {understanding.capitalize()}: {count} ({percentage:.1f}%)")
         
         # Bot performance distribution
-        performance_counts = {p: bot_performance.count(p) for p in ['good', 'acceptable', 'poor']}
         print("\nBot Performance Distribution:")
-        for performance, count in performance_counts.items():
+        for performance in ['good', 'acceptable', 'poor']:
+            count = performance_counts[performance]
             percentage = (count / len(results)) * 100
             print(f"  • {performance.capitalize()}: {count} ({percentage:.1f}%)")
         
         # Most common categories
-        all_categories = []
-        for result in results:
-            all_categories.extend(result['llm_classification']['categories'])
-        
-        category_counts = {}
-        for category in all_categories:
-            category_counts[category] = category_counts.get(category, 0) + 1
-        
+        total_categories = sum(category_counts.values())
         print("\nTop 5 Categories:")
-        sorted_categories = sorted(category_counts.items(), key=lambda x: x[1], reverse=True)[:5]
-        for category, count in sorted_categories:
-            percentage = (count / len(all_categories)) * 100
+        for category, count in category_counts.most_common(5):
+            percentage = (count / total_categories) * 100
             print(f"  • {category}: {count} ({percentage:.1f}%)")
 
 
@@ -368,22 +1095,26 @@ def main():
         if start is not None and end is not None:
             print(f"\nStarting analysis of conversations {start+1}-{end}...")
         else:
-            print(f"\nStarting analysis of all {len(conversations)} conversations...")
+            print("\nStarting analysis of all conversations...")
         
         confirm = input("Continue? (y/n): ").strip().lower()
         if confirm not in ['y', 'yes']:
             print("Operation cancelled.")
             return
         
-        # Analyze conversations
-        results = analyzer.analyze_conversations(conversations, start, end)
+        # Analyze conversations: full runs go through the Batch API,
+        # numbers and ranges are analyzed immediately.
+        # Results are checkpointed to the output file as they complete.
+        if start is None and end is None:
+            results = analyzer.analyze_conversations_batch(conversations, output_file=OUTPUT_FILE)
+        else:
+            results = analyzer.analyze_conversations(conversations, start, end, output_file=OUTPUT_FILE)
         
         if not results:
-            print("No conversations were successfully analyzed.")
+            print("No new conversations were analyzed.")
             return
         
-        # Save results
-        analyzer.save_results(results)
+        analyzer.report_results(results, OUTPUT_FILE, show_total=True)
         
         print("\nAnalysis completed successfully!")
         
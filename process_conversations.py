@@ -3,21 +3,48 @@
 Process conversation data from JSON file and create cleaned output for sentiment analysis.
 """
 
-import json
+import codecs
+import contextlib
+import functools
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from typing import Dict, List, Any, Optional
 
+import ijson
+import orjson
 
+
+# Markdown emphasis, in the order it is stripped: bold before italic so "**x**" is not read as two italics
+ASTERISK_PATTERNS = (
+    re.compile(r'\*\*(.*?)\*\*'),  # Bold
+    re.compile(r'\*(.*?)\*'),      # Italic
+)
+UNDERSCORE_PATTERNS = (
+    re.compile(r'__(.*?)__'),      # Bold underline
+    re.compile(r'_(.*?)_'),        # Italic underline
+)
+
+
+@functools.lru_cache(maxsize=4096)  # Bot template messages repeat verbatim across conversations
 def decode_unicode_escapes(text: str) -> str:
     """Decode Unicode escape sequences to actual characters."""
+    # Without a backslash there is nothing to decode and the codec round trip is a no-op
+    if '\\' not in text:
+        return text
+    
     try:
-        return text.encode('utf-8').decode('unicode_escape').encode('latin1').decode('utf-8')
+        decoded = codecs.decode(text, 'unicode_escape')
+    except UnicodeDecodeError:
+        return text
+    
+    try:
+        # Escaped UTF-8 bytes (e.g. \xc3\xa7) come out as latin1 characters, re-decode them
+        return decoded.encode('latin1').decode('utf-8')
     except (UnicodeDecodeError, UnicodeEncodeError):
-        # Fallback: try direct decode
-        try:
-            return text.encode().decode('unicode_escape')
-        except:
-            return text
+        # Fallback: keep the escape-decoded text
+        return decoded
 
 
 def clean_text(text: str) -> str:
@@ -28,14 +55,17 @@ def clean_text(text: str) -> str:
     # Decode Unicode escape sequences
     text = decode_unicode_escapes(text)
     
-    # Remove markdown formatting
-    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)  # Bold
-    text = re.sub(r'\*(.*?)\*', r'\1', text)      # Italic
-    text = re.sub(r'__(.*?)__', r'\1', text)      # Bold underline
-    text = re.sub(r'_(.*?)_', r'\1', text)        # Italic underline
+    # Remove markdown formatting; a pattern can only match when its delimiter is present,
+    # so most messages skip the regex passes entirely
+    if '*' in text:
+        for pattern in ASTERISK_PATTERNS:
+            text = pattern.sub(r'\1', text)
+    if '_' in text:
+        for pattern in UNDERSCORE_PATTERNS:
+            text = pattern.sub(r'\1', text)
     
-    # Clean up extra whitespace
-    text = re.sub(r'\s+', ' ', text).strip()
+    # Clean up extra whitespace (str.split() splits on the same characters as \s and drops the ends)
+    text = ' '.join(text.split())
     
     return text
 
@@ -87,10 +117,7 @@ def process_conversation(conv_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         return None
     
     # Build transcript_full_text
-    transcript_lines = []
-    for msg in processed_messages:
-        transcript_lines.append(f"{msg['sender']}: {msg['text']}")
-    transcript_full_text = "\n".join(transcript_lines)
+    transcript_full_text = "\n".join(f"{msg['sender']}: {msg['text']}" for msg in processed_messages)
     
     # Build metadata
     start_time = processed_messages[0]["timestamp"]
@@ -107,53 +134,106 @@ def process_conversation(conv_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     }
 
 
-def process_conversations_file(input_file: str, output_file: str, max_conversations: int = 100):
+def _process_and_serialize(conv_data: Dict[str, Any]) -> Optional[bytes]:
+    """
+    Process a single conversation and serialize it for the output file (runs in a worker process).
+    Returns the indented JSON with every line shifted by two spaces, or None if the conversation has no valid messages.
+    """
+    cleaned_conv = process_conversation(conv_data)
+    if not cleaned_conv:
+        return None
+    
+    # Same layout as an indented dump of the whole list; JSON strings never
+    # contain raw newlines, so every newline is a line break of the dump
+    return b'  ' + orjson.dumps(cleaned_conv, option=orjson.OPT_INDENT_2).replace(b'\n', b'\n  ')
+
+
+def _may_be_json_array(f) -> bool:
+    """
+    Return False if the JSON document in f does not start with an array, then rewind f.
+    Empty input returns True and is left for the parser to report.
+    """
+    while True:
+        chunk = f.read(4096)
+        stripped = chunk.lstrip()
+        if stripped or not chunk:
+            break
+    
+    f.seek(0)
+    return not stripped or stripped.startswith(b'[')
+
+
+def process_conversations_file(input_file: str, output_file: str, max_conversations: int = 100, max_workers: Optional[int] = None, chunksize: int = 32):
     """
     Process conversations from input file and save cleaned format to output file.
+    Conversations are cleaned in parallel across max_workers processes (default: all CPU cores).
+    The input is read in bounded slices and the output is written as results arrive, so memory stays small.
+    Results go to a temporary file that replaces output_file only if the input is read without errors.
     """
     print(f"Loading conversations from {input_file}...")
     
     try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except json.JSONDecodeError as e:
-        print(f"Error parsing JSON: {e}")
-        return
+        f = open(input_file, 'rb')
     except FileNotFoundError:
         print(f"File not found: {input_file}")
         return
     
-    if not isinstance(data, list):
-        print("Error: Expected JSON array at root level")
-        return
-    
-    print(f"Found {len(data)} conversations in file")
+    with f:
+        if not _may_be_json_array(f):
+            print("Error: Expected JSON array at root level")
+            return
     
-    # Process conversations
-    cleaned_conversations = []
-    processed_count = 0
-    
-    for i, conv_data in enumerate(data):
-        if processed_count >= max_conversations:
-            break
-            
-        cleaned_conv = process_conversation(conv_data)
-        if cleaned_conv:
-            cleaned_conversations.append(cleaned_conv)
-            processed_count += 1
+        max_workers = max_workers or os.cpu_count() or 1
+        slice_size = max_workers * chunksize * 4
+        # A single worker gains nothing from a pool, so process in this process instead
+        executor = ProcessPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+        
+        # Process conversations, writing each cleaned one as soon as it is ready
+        processed_count = 0
+        read_count = 0
+        temp_file = f"{output_file}.tmp"
+        
+        print(f"Saving to {output_file}...")
+        try:
+            with open(temp_file, 'wb') as out, executor or contextlib.nullcontext():
+                out.write(b'[')
+                conversations = ijson.items(f, 'item', use_float=True)
+                
+                try:
+                    while processed_count < max_conversations:
+                        # Each conversation yields at most one valid result, so never read more than still needed
+                        batch = list(islice(conversations, min(slice_size, max_conversations - processed_count)))
+                        if not batch:
+                            break
+                        
+                        if executor:
+                            results = executor.map(_process_and_serialize, batch, chunksize=chunksize)
+                        else:
+                            results = map(_process_and_serialize, batch)
+                        
+                        for serialized in results:
+                            read_count += 1
+                            if serialized:
+                                out.write(b',\n' if processed_count else b'\n')
+                                out.write(serialized)
+                                processed_count += 1
+                            
+                            if read_count % 10 == 0:
+                                print(f"Processed {read_count} conversations, {processed_count} valid")
+                except ijson.JSONError as e:
+                    # Keep any existing output rather than replacing it with a partial one
+                    print(f"Error parsing JSON: {e}")
+                    return
+                
+                out.write(b'\n]' if processed_count else b']')
             
-        if (i + 1) % 10 == 0:
-            print(f"Processed {i + 1} conversations, {processed_count} valid")
+            os.replace(temp_file, output_file)
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
     
-    print(f"\nSuccessfully processed {processed_count} conversations")
-    
-    # Save output
-    print(f"Saving to {output_file}...")
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(cleaned_conversations, f, ensure_ascii=False, indent=2)
-    
-    print(f"Done! Saved {len(cleaned_conversations)} conversations to {output_file}")
-
+    print(f"\nSuccessfully processed {processed_count} of {read_count} conversations read")
+    print(f"Done! Saved {processed_count} conversations to {output_file}")
 
 if __name__ == "__main__":
     input_file = "last-500-conversation-dugunbuketi.json"
@@ -3,76 +3,81 @@
 Validate JSONL file format for OpenAI fine-tuning
 """
 
-import json
+import orjson
+
+# Fields every assistant response must contain
+REQUIRED_FIELDS = ('overall_sentiment', 'bot_understanding', 'bot_performance', 'bot_answered')
+REQUIRED_FIELD_SET = frozenset(REQUIRED_FIELDS)
 
 def validate_jsonl(filename):
     print(f'🔍 Validating JSONL file: {filename}')
     
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        print(f'📊 Total lines: {len(lines)}')
-        
         valid_count = 0
-        for i, line in enumerate(lines, 1):
-            line = line.strip()
-            if not line:
-                print(f'❌ Line {i}: Empty line')
-                continue
+        total_lines = 0
+        
+        # Stream the file line by line so memory stays O(single line); orjson parses
+        # the raw bytes directly, so lines are never decoded to str
+        with open(filename, 'rb') as f:
+            for i, line in enumerate(f, 1):
+                total_lines = i
+                line = line.strip()
+                if not line:
+                    print(f'❌ Line {i}: Empty line')
+                    continue
                 
-            try:
-                json_obj = json.loads(line)
+                try:
+                    json_obj = orjson.loads(line)
                 
-                # Check if it has required structure
-                if 'messages' not in json_obj:
-                    print(f'❌ Line {i}: Missing "messages" field')
-                    continue
+                    # Check if it has required structure
+                    if 'messages' not in json_obj:
+                        print(f'❌ Line {i}: Missing "messages" field')
+                        continue
                     
-                if not isinstance(json_obj['messages'], list):
-                    print(f'❌ Line {i}: "messages" is not a list')
-                    continue
+                    if not isinstance(json_obj['messages'], list):
+                        print(f'❌ Line {i}: "messages" is not a list')
+                        continue
                     
-                if len(json_obj['messages']) != 3:
-                    print(f'❌ Line {i}: Expected 3 messages, got {len(json_obj["messages"])}')
-                    continue
+                    if len(json_obj['messages']) != 3:
+                        print(f'❌ Line {i}: Expected 3 messages, got {len(json_obj["messages"])}')
+                        continue
                     
-                # Check message roles
-                roles = [msg.get('role') for msg in json_obj['messages']]
-                expected_roles = ['system', 'user', 'assistant']
-                if roles != expected_roles:
-                    print(f'❌ Line {i}: Expected roles {expected_roles}, got {roles}')
-                    continue
+                    # Check message roles
+                    roles = [msg.get('role') for msg in json_obj['messages']]
+                    expected_roles = ['system', 'user', 'assistant']
+                    if roles != expected_roles:
+                        print(f'❌ Line {i}: Expected roles {expected_roles}, got {roles}')
+                        continue
                 
-                # Check if assistant message has content
-                assistant_msg = json_obj['messages'][2]
-                if 'content' not in assistant_msg or not assistant_msg['content']:
-                    print(f'❌ Line {i}: Assistant message missing content')
-                    continue
+                    # Check if assistant message has content
+                    assistant_msg = json_obj['messages'][2]
+                    if 'content' not in assistant_msg or not assistant_msg['content']:
+                        print(f'❌ Line {i}: Assistant message missing content')
+                        continue
                 
-                # Try to parse assistant response as JSON
-                try:
-                    assistant_json = json.loads(assistant_msg['content'])
-                    required_fields = ['overall_sentiment', 'bot_understanding', 'bot_performance', 'bot_answered']
-                    missing_fields = [field for field in required_fields if field not in assistant_json]
-                    if missing_fields:
-                        print(f'❌ Line {i}: Missing fields in assistant response: {missing_fields}')
+                    # Try to parse assistant response as JSON
+                    try:
+                        assistant_json = orjson.loads(assistant_msg['content'])
+                        if not REQUIRED_FIELD_SET.issubset(assistant_json):
+                            missing_fields = [field for field in REQUIRED_FIELDS if field not in assistant_json]
+                            print(f'❌ Line {i}: Missing fields in assistant response: {missing_fields}')
+                            continue
+                    except orjson.JSONDecodeError:
+                        print(f'❌ Line {i}: Assistant content is not valid JSON')
                         continue
-                except json.JSONDecodeError:
-                    print(f'❌ Line {i}: Assistant content is not valid JSON')
-                    continue
                     
-                valid_count += 1
-                if i <= 3:  # Show details for first 3
-                    print(f'✅ Line {i}: Valid JSON with {len(json_obj["messages"])} messages')
+                    valid_count += 1
+                    if i <= 3:  # Show details for first 3
+                        print(f'✅ Line {i}: Valid JSON with {len(json_obj["messages"])} messages')
                     
-            except json.JSONDecodeError as e:
-                print(f'❌ Line {i}: Invalid JSON - {e}')
-                continue
+                except orjson.JSONDecodeError as e:
+                    print(f'❌ Line {i}: Invalid JSON - {e}')
+                    continue
         
-        print(f'📋 Summary: {valid_count}/{len(lines)} lines are valid JSONL')
+        print(f'📊 Total lines: {total_lines}')
+        print(f'📋 Summary: {valid_count}/{total_lines} lines are valid JSONL')
         
-        if valid_count == len(lines):
+        if valid_count == total_lines:
             print('🎉 All lines are valid JSONL format!')
             return True
         else: